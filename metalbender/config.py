@@ -33,13 +33,20 @@ def clear_access_secret_version_cache() -> None:
     _access_secret_version.cache_clear()
 
 
-def _get_envvar_str(envvar_name: str) -> str:
-    project = os.getenv(envvar_name, None)
+def _get_envvar_str(envvar_name: str, default: str | None = None) -> str:
+    project = os.getenv(envvar_name, default)
     if project is None:
         raise ValueError(f"{envvar_name} is not set")
     return project
 
 
+def _get_envvar_bool(envvar_name: str, default: str | None = None) -> bool:
+    value = _get_envvar_str(envvar_name, default).lower()
+    if value not in ("true", "false", "1", "0"):
+        raise ValueError(f"{envvar_name} is not a valid boolean: {value}")
+    return value in ("true", "1")
+
+
 def _get_envvar_list(envvar_name: str) -> list[str]:
     project = os.getenv(envvar_name, None)
     if project is None:
@@ -111,6 +118,46 @@ def get_fastapi_password() -> str:
     return _get_envvar_str("FASTAPI_PASSWORD")
 
 
+def get_gce_quota_rate() -> float:
+    return float(_get_envvar_str("GCE_QUOTA_RATE", "5"))
+
+
+def get_gce_quota_burst() -> float:
+    return float(_get_envvar_str("GCE_QUOTA_BURST", "20"))
+
+
+def get_label_index_max_age_seconds() -> float:
+    return float(_get_envvar_str("LABEL_INDEX_MAX_AGE_SECONDS", "300"))
+
+
+def get_profiling_enabled() -> bool:
+    return _get_envvar_bool("PROFILING_ENABLED", "false")
+
+
+def get_profiling_sample_rate() -> float:
+    return float(_get_envvar_str("PROFILING_SAMPLE_RATE", "0"))
+
+
+def get_profiling_interval_seconds() -> float:
+    return float(_get_envvar_str("PROFILING_INTERVAL_SECONDS", "0.005"))
+
+
+def get_profiling_max_stored() -> int:
+    return int(_get_envvar_str("PROFILING_MAX_STORED", "50"))
+
+
+def get_storage_backend() -> str:
+    return _get_envvar_str("STORAGE_BACKEND", "postgres")
+
+
+def get_sqlite_path() -> str:
+    return _get_envvar_str("SQLITE_PATH", "metalbender.db")
+
+
+def get_sqlite_busy_timeout_seconds() -> float:
+    return float(_get_envvar_str("SQLITE_BUSY_TIMEOUT_SECONDS", "30"))
+
+
 def get_sql_client_key_path() -> Path:
     return _get_secret_manager_file(
         _get_envvar_str("SQL_CLIENT_KEY_SECRETS_MANAGER_NAME"),
@@ -1,24 +1,81 @@
 import typing as t
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import Session as SessionType
 
 from metalbender.config import (get_database_url, get_sql_client_cert_path,
                                 get_sql_client_key_path,
-                                get_sql_server_ca_path)
+                                get_sql_server_ca_path,
+                                get_sqlite_busy_timeout_seconds,
+                                get_sqlite_path,
+                                get_storage_backend)
 from metalbender.data_access import models  # noqa: F401
 from metalbender.data_access._base import Base  # noqa: F401
 
-ENGINE = create_engine(
-    get_database_url(),
-    connect_args={
-        'sslmode': 'verify-ca',
-        'sslrootcert': str(get_sql_server_ca_path().absolute()),
-        'sslcert': str(get_sql_client_cert_path().absolute()),
-        'sslkey': str(get_sql_client_key_path().absolute()),
-    }
-)
+
+def _create_postgres_engine() -> Engine:
+    return create_engine(
+        get_database_url(),
+        connect_args={
+            'sslmode': 'verify-ca',
+            'sslrootcert': str(get_sql_server_ca_path().absolute()),
+            'sslcert': str(get_sql_client_cert_path().absolute()),
+            'sslkey': str(get_sql_client_key_path().absolute()),
+        }
+    )
+
+
+def _create_sqlite_engine() -> Engine:
+    """
+    Create an embedded SQLite engine for single-node deployments.
+
+    The database file is opened in WAL mode, so readers don't block the writer. Every session gets its own
+    connection, so a rollback never discards another request's work. Writers wait up to the busy timeout for
+    the write lock. The schema is created on startup since the alembic migrations only target Postgres.
+    """
+    sqlite_path = get_sqlite_path()
+    if sqlite_path == ':memory:':
+        raise ValueError("SQLITE_PATH must be a file, an in-memory database would be shared by all sessions")
+
+    engine = create_engine(
+        f'sqlite:///{sqlite_path}',
+        connect_args={
+            'check_same_thread': False,
+            'timeout': get_sqlite_busy_timeout_seconds(),
+        },
+    )
+
+    @event.listens_for(engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+    Base.metadata.create_all(engine)
+
+    return engine
+
+
+_ENGINE_FACTORIES: dict[str, t.Callable[[], Engine]] = {
+    'postgres': _create_postgres_engine,
+    'sqlite': _create_sqlite_engine,
+}
+
+
+def create_storage_engine(storage_backend: str) -> Engine:
+    try:
+        engine_factory = _ENGINE_FACTORIES[storage_backend]
+    except KeyError as ke:
+        raise ValueError(
+            f"Unknown storage backend {storage_backend!r}, expected one of {sorted(_ENGINE_FACTORIES)}") from ke
+
+    return engine_factory()
+
+
+ENGINE = create_storage_engine(get_storage_backend())
 
 _SessionMaker = sessionmaker(bind=ENGINE)
 
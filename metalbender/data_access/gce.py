@@ -1,7 +1,9 @@
 from metalbender.data_access import SessionType
 from metalbender.data_access.models import GceInstance
+from metalbender.profiling import profiled
 
 
+@profiled
 def find_gce_instance(
     db_session: SessionType,
     instance_project_id: str,
@@ -19,6 +21,7 @@ def find_gce_instance(
     )
 
 
+@profiled
 def create_gce_instance(
     db_session: SessionType,
     instance_project_id: str,
@@ -36,6 +39,7 @@ def create_gce_instance(
     return instance
 
 
+@profiled
 def find_or_create_gce_instance(
     db_session: SessionType,
     instance_project_id: str,
@@ -59,3 +63,36 @@ def find_or_create_gce_instance(
         )
 
     return instance
+
+
+@profiled
+def find_or_create_gce_instances(
+    db_session: SessionType,
+    instance_project_id: str,
+    instance_zone_names: list[tuple[str, str]],
+) -> list[GceInstance]:
+    names = {name for _, name in instance_zone_names}
+    existing = {
+        (x.zone, x.name): x
+        for x in (
+            db_session.query(GceInstance)
+            .filter(
+                GceInstance.project_id == instance_project_id,
+                GceInstance.name.in_(names),
+            )
+            .all()
+        )
+    }
+
+    # Create the missing instances in a single flush.
+    missing = [
+        GceInstance(project_id=instance_project_id, zone=zone, name=name)
+        for zone, name in instance_zone_names
+        if (zone, name) not in existing
+    ]
+    if missing:
+        db_session.add_all(missing)
+        db_session.flush()
+        existing.update({(x.zone, x.name): x for x in missing})
+
+    return [existing[x] for x in instance_zone_names]
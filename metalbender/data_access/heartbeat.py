@@ -2,12 +2,14 @@ import datetime as dt
 
 from metalbender.data_access import SessionType
 from metalbender.data_access.models import GceInstance, Heartbeat
+from metalbender.profiling import profiled
 
 
 def calculate_deadline_time(start_time: dt.datetime, seconds_to_deadline: int) -> dt.datetime:
     return start_time + dt.timedelta(seconds=seconds_to_deadline)
 
 
+@profiled
 def create_heartbeat(
     db_session: SessionType,
     instance_id: int,
@@ -24,11 +26,34 @@ def create_heartbeat(
     return heartbeat
 
 
+@profiled
+def create_heartbeats(
+    db_session: SessionType,
+    instance_ids: list[int],
+    deadline_time: dt.datetime,
+) -> list[Heartbeat]:
+    added = dt.datetime.utcnow()
+    heartbeats = [
+        Heartbeat(
+            instance_id=instance_id,
+            added=added,
+            deadline=deadline_time,
+        )
+        for instance_id in instance_ids
+    ]
+    db_session.add_all(heartbeats)
+    db_session.flush()
+
+    return heartbeats
+
+
+@profiled
 def remove_heartbeats(db_session: SessionType):
     db_session.query(Heartbeat).filter(Heartbeat.deadline < dt.datetime.utcnow()).delete()
     db_session.commit()
 
 
+@profiled
 def get_valid_heartbeats(
     db_session: SessionType,
     current_time_utc: dt.datetime,
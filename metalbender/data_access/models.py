@@ -14,7 +14,7 @@ class GceInstance(Base):
 
     __table_args__ = (
         Index('idx_resource_type_id', 'project_id'),
-        Index('idx_resource_type_id', 'zone'),
+        Index('idx_gce_instance_zone', 'zone'),
     )
 
 
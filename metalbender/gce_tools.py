@@ -1,13 +1,21 @@
 from google.cloud import compute
 
+from metalbender.label_index import IndexedInstance, get_label_index
+from metalbender.profiling import profiled
+from metalbender.quota import GceOperation, get_gce_quota_limiter
 
+
+@profiled
 def start_gce_instance(
     comp_client: compute.InstancesClient,
     instance_project_id: str,
     instance_zone: str,
     instance_name: str,
 ) -> None:
+    limiter = get_gce_quota_limiter()
+
     # Check if the instance is running.
+    limiter.acquire(instance_project_id, GceOperation.get)
     instance = comp_client.get(
         project=instance_project_id,
         zone=instance_zone,
@@ -15,6 +23,7 @@ def start_gce_instance(
     )
 
     if instance.status != 'RUNNING':
+        limiter.acquire(instance_project_id, GceOperation.start)
         comp_client.start(
             project=instance_project_id,
             zone=instance_zone,
@@ -22,28 +31,77 @@ def start_gce_instance(
         )
 
 
-def get_running_gce_instances(
+@profiled
+def start_indexed_gce_instances(
+    comp_client: compute.InstancesClient,
+    instances: list[IndexedInstance],
+) -> None:
+    limiter = get_gce_quota_limiter()
+    label_index = get_label_index()
+
+    # The statuses come from the listing made for this request, so only instances that aren't running are touched.
+    for instance in instances:
+        if instance.is_active:
+            continue
+
+        limiter.acquire(instance.project_id, GceOperation.start)
+        comp_client.start(
+            project=instance.project_id,
+            zone=instance.zone,
+            instance=instance.name,
+        )
+        label_index.set_status(instance.project_id, instance.zone, instance.name, 'STAGING')
+
+
+@profiled
+def list_gce_instances(
     comp_client: compute.InstancesClient,
     project: str,
 ) -> list[compute.Instance]:
+    get_gce_quota_limiter().acquire(project, GceOperation.list)
     agg_list = comp_client.aggregated_list(project=project)
     instance_lists = [
         x[1].instances
         for x in agg_list
         if x[1].warning.code != 'NO_RESULTS_ON_PAGE'
     ]
-    instances = [x for y in instance_lists for x in y if x.status == 'RUNNING']
+    instances = [x for y in instance_lists for x in y]
+
+    # Every listing refreshes the label index, so label keep-alives rarely need a listing of their own.
+    get_label_index().update(project, [
+        IndexedInstance(
+            project_id=project,
+            zone=x.zone.split('/')[-1],
+            name=x.name,
+            status=x.status,
+            labels=tuple(sorted(x.labels.items())),
+        )
+        for x in instances
+    ])
+
     return instances
 
 
+@profiled
+def get_running_gce_instances(
+    comp_client: compute.InstancesClient,
+    project: str,
+) -> list[compute.Instance]:
+    instances = list_gce_instances(comp_client=comp_client, project=project)
+    return [x for x in instances if x.status == 'RUNNING']
+
+
+@profiled
 def stop_gce_instance(
     project: str,
     instance: compute.Instance,
     zone: str,
 ) -> None:
+    get_gce_quota_limiter().acquire(project, GceOperation.stop)
     comp_client = compute.InstancesClient()
     comp_client.stop(
         project=project,
         zone=zone.split('/')[-1],
         instance=instance.name,
     )
+    get_label_index().set_status(project, zone.split('/')[-1], instance.name, 'STOPPING')
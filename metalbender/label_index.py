@@ -0,0 +1,108 @@
+import threading
+import time
+import typing as t
+from collections import defaultdict
+from dataclasses import dataclass, replace
+from functools import lru_cache
+
+import metalbender.config as config
+
+# Statuses where the instance is, or is about to be, running.
+_ACTIVE_STATUSES = ('RUNNING', 'PROVISIONING', 'STAGING')
+
+
+@dataclass(frozen=True)
+class IndexedInstance:
+    project_id: str
+    zone: str
+    name: str
+    status: str
+    labels: tuple[tuple[str, str], ...]
+
+    @property
+    def key(self) -> tuple[str, str]:
+        return self.zone, self.name
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in _ACTIVE_STATUSES
+
+
+class LabelIndex:
+    """
+    In-process index from GCE labels to instances, per project.
+
+    The index is fed with the instance listings gce_tools already makes. Each listing replaces the project's
+    instances, and only the instances that changed are moved in the label postings. Only `update` adds projects.
+    """
+
+    def __init__(self, max_age_seconds: float):
+        self.max_age_seconds = max_age_seconds
+        self._instances: dict[str, dict[tuple[str, str], IndexedInstance]] = defaultdict(dict)
+        self._postings: dict[str, dict[tuple[str, str], set[tuple[str, str]]]] = defaultdict(lambda: defaultdict(set))
+        self._refreshed: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _remove(self, project_id: str, instance: IndexedInstance) -> None:
+        postings = self._postings[project_id]
+        for label in instance.labels:
+            postings[label].discard(instance.key)
+            if not postings[label]:
+                del postings[label]
+        del self._instances[project_id][instance.key]
+
+    def _add(self, project_id: str, instance: IndexedInstance) -> None:
+        postings = self._postings[project_id]
+        for label in instance.labels:
+            postings[label].add(instance.key)
+        self._instances[project_id][instance.key] = instance
+
+    def update(self, project_id: str, instances: t.Iterable[IndexedInstance]) -> None:
+        """
+        Replace the indexed instances of `project_id` with a complete listing of the project.
+        """
+        listed = {x.key: x for x in instances}
+        with self._lock:
+            current = self._instances[project_id]
+            for key in [x for x in current if x not in listed]:
+                self._remove(project_id, current[key])
+
+            for key, instance in listed.items():
+                previous = current.get(key)
+                if previous == instance:
+                    continue
+                if previous is not None:
+                    self._remove(project_id, previous)
+                self._add(project_id, instance)
+
+            self._refreshed[project_id] = time.monotonic()
+
+    def set_status(self, project_id: str, zone: str, name: str, status: str) -> None:
+        with self._lock:
+            instance = self._instances.get(project_id, {}).get((zone, name))
+            if instance is not None:
+                self._instances[project_id][instance.key] = replace(instance, status=status)
+
+    def is_stale(self, project_id: str) -> bool:
+        with self._lock:
+            refreshed = self._refreshed.get(project_id)
+        return refreshed is None or time.monotonic() - refreshed > self.max_age_seconds
+
+    def match(self, project_id: str, selector: dict[str, str]) -> list[IndexedInstance]:
+        """
+        Find the instances of `project_id` carrying every label in `selector`.
+        """
+        with self._lock:
+            postings = self._postings.get(project_id, {})
+            candidates = sorted((postings.get(x, set()) for x in selector.items()), key=len)
+            if not candidates:
+                return []
+
+            keys = set.intersection(*candidates)
+            instances = self._instances.get(project_id, {})
+            return [instances[x] for x in sorted(keys)]
+
+
+@lru_cache(maxsize=1)
+def get_label_index() -> LabelIndex:
+    return LabelIndex(max_age_seconds=config.get_label_index_max_age_seconds())
@@ -1,9 +1,11 @@
 import asyncio
+import base64
 import datetime as dt
+import math
 from enum import Enum
 
 from fastapi import Depends, FastAPI, HTTPException, status
-from fastapi.responses import Response
+from fastapi.responses import PlainTextResponse, Response
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from google.api_core import exceptions as gcp_exceptions
 from google.cloud import compute
@@ -12,13 +14,21 @@ from starlette.concurrency import run_in_threadpool
 
 import metalbender.config as config
 from metalbender.data_access import SessionType, get_session
-from metalbender.data_access.gce import find_or_create_gce_instance
+from metalbender.data_access.gce import (find_or_create_gce_instance,
+                                         find_or_create_gce_instances)
 from metalbender.data_access.heartbeat import (calculate_deadline_time,
                                                create_heartbeat,
+                                               create_heartbeats,
                                                get_valid_heartbeats,
                                                remove_heartbeats)
 from metalbender.gce_tools import (get_running_gce_instances,
-                                   start_gce_instance, stop_gce_instance)
+                                   list_gce_instances, start_gce_instance,
+                                   start_indexed_gce_instances,
+                                   stop_gce_instance)
+from metalbender.label_index import get_label_index
+from metalbender.profiling import ProfilingMiddleware, get_profiler
+from metalbender.quota import (GceOperation, GceQuotaExceeded,
+                               get_gce_quota_limiter)
 
 app = FastAPI()
 security = HTTPBasic()
@@ -44,10 +54,25 @@ class BasicUser(BaseModel):
     password: str
 
 
+def check_credentials(username: str, password: str) -> bool:
+    return username == config.get_fastapi_username() and password == config.get_fastapi_password()
+
+
+def is_authorized(authorization: str | None) -> bool:
+    scheme, _, param = (authorization or "").partition(" ")
+    if scheme.lower() != "basic":
+        return False
+
+    try:
+        username, _, password = base64.b64decode(param).decode("ascii").partition(":")
+    except (ValueError, UnicodeDecodeError):
+        return False
+
+    return check_credentials(username, password)
+
+
 def get_user_credentials(credentials: HTTPBasicCredentials = Depends(security)) -> BasicUser:
-    correct_username = config.get_fastapi_username()
-    correct_password = config.get_fastapi_password()
-    if credentials.username != correct_username or credentials.password != correct_password:
+    if not check_credentials(credentials.username, credentials.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials",
@@ -57,6 +82,28 @@ def get_user_credentials(credentials: HTTPBasicCredentials = Depends(security))
     return BasicUser(username=credentials.username, password=credentials.password)
 
 
+# Quota errors from our own buckets, and from the Compute API when the project-wide quota is exhausted.
+QUOTA_ERRORS = (GceQuotaExceeded, gcp_exceptions.TooManyRequests)
+
+
+def get_retry_after_header(retry_after: float) -> dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(retry_after)))}
+
+
+def get_quota_retry_after(error: Exception) -> float:
+    if isinstance(error, GceQuotaExceeded):
+        return error.retry_after
+
+    # The Compute API doesn't say when to retry, so wait for one token of our own buckets.
+    return 1 / get_gce_quota_limiter().rate
+
+
+def get_deferred_message(error: Exception) -> str:
+    if isinstance(error, GceQuotaExceeded) and error.operation == GceOperation.start:
+        return "start deferred due to GCE quota, retry the keep-alive"
+    return "check deferred due to GCE quota, retry the keep-alive"
+
+
 @app.get('/health')
 async def health(
     _: str = Depends(get_user_credentials),
@@ -109,6 +156,9 @@ async def keep_alive(
             deadline_time=deadline_time,
         )
 
+        # Commit before calling Compute, so the write transaction isn't held open for the API latency.
+        await run_in_threadpool(db_session.commit)
+
         comp_client = compute.InstancesClient()
 
         await run_in_threadpool(
@@ -121,6 +171,125 @@ async def keep_alive(
 
         api_response = ApiResponse(status=Status.ok, message="Keep-alive request added.")
         response = Response(status_code=status.HTTP_200_OK, content=api_response.model_dump_json())
+    except QUOTA_ERRORS as e:
+        # The heartbeat is committed, the client retries the keep-alive to get the instance checked or started.
+        api_response = ApiResponse(status=Status.warning, message=f"Keep-alive request added, instance {get_deferred_message(e)}.")
+        response = Response(
+            status_code=status.HTTP_202_ACCEPTED,
+            content=api_response.model_dump_json(),
+            headers=get_retry_after_header(get_quota_retry_after(e)),
+        )
+    except gcp_exceptions.Forbidden:
+        db_session.rollback()
+        api_response = ApiResponse(status=Status.error, message="You don't have permission to access this GCP resource.")
+        response = Response(status_code=status.HTTP_403_FORBIDDEN, content=api_response.model_dump_json())
+    except RequestError as e:
+        db_session.rollback()
+        api_response = ApiResponse(status=Status.error, message=str(e))
+        response = Response(status_code=status.HTTP_400_BAD_REQUEST, content=api_response.model_dump_json())
+    except Exception:
+        db_session.rollback()
+        api_response = ApiResponse(status=Status.error, message="Unspecified error.")
+        response = Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content=api_response.model_dump_json())
+
+    return response
+
+
+class KeepAliveLabelsRequest(BaseModel):
+    instance_project_id: str
+    labels: dict[str, str]
+
+    deadline_seconds: int
+
+
+@app.post('/keep-alive/labels')
+async def keep_alive_labels(
+    request: KeepAliveLabelsRequest,
+    db_session: SessionType = Depends(get_session),
+    _: str = Depends(get_user_credentials),
+):
+    response: Response
+    api_response: ApiResponse
+    instance_count: int | None = None
+    try:
+        if request.deadline_seconds < 10:
+            raise RequestError("Deadline must be at least 10 seconds to ensure start/stop doesn't overlap.")
+        if not request.labels:
+            raise RequestError("At least one label must be given.")
+
+        db_session.begin()
+
+        comp_client = compute.InstancesClient()
+        label_index = get_label_index()
+
+        # List the project on every request, so starts are decided on current statuses. It's one call for the whole
+        # matched set. If the listing is over quota, a fresh index still resolves the selector and the starts are deferred.
+        list_error: Exception | None = None
+        try:
+            await run_in_threadpool(list_gce_instances, comp_client=comp_client, project=request.instance_project_id)
+        except QUOTA_ERRORS as e:
+            if label_index.is_stale(request.instance_project_id):
+                raise
+            list_error = e
+        instances = label_index.match(request.instance_project_id, request.labels)
+
+        if not instances:
+            raise RequestError("No instances match the given labels.")
+
+        gce_instances = await run_in_threadpool(
+            find_or_create_gce_instances,
+            db_session=db_session,
+            instance_project_id=request.instance_project_id,
+            instance_zone_names=[x.key for x in instances],
+        )
+
+        deadline_time = calculate_deadline_time(
+            start_time=dt.datetime.utcnow(),
+            seconds_to_deadline=request.deadline_seconds,
+        )
+        await run_in_threadpool(
+            create_heartbeats,
+            db_session=db_session,
+            instance_ids=[x.id for x in gce_instances],  # type: ignore
+            deadline_time=deadline_time,
+        )
+        instance_count = len(instances)
+
+        # Commit before calling Compute, so the write transaction isn't held open for the API latency.
+        await run_in_threadpool(db_session.commit)
+
+        if list_error is not None:
+            raise list_error
+
+        await run_in_threadpool(
+            start_indexed_gce_instances,
+            comp_client=comp_client,
+            instances=instances,
+        )
+
+        api_response = ApiResponse(status=Status.ok, message=f"Keep-alive request added for {len(instances)} instances.")
+        response = Response(status_code=status.HTTP_200_OK, content=api_response.model_dump_json())
+    except QUOTA_ERRORS as e:
+        if instance_count is None:
+            # The selector couldn't be resolved, so nothing was recorded.
+            db_session.rollback()
+            api_response = ApiResponse(status=Status.error, message="GCE quota exhausted, try again later.")
+            response = Response(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                content=api_response.model_dump_json(),
+                headers=get_retry_after_header(get_quota_retry_after(e)),
+            )
+        else:
+            # The heartbeats are committed, the client retries the keep-alive to get the remaining instances started.
+            api_response = ApiResponse(
+                status=Status.warning,
+                message=f"Keep-alive request added for {instance_count} instances, {get_deferred_message(e)}.",
+            )
+            response = Response(
+                status_code=status.HTTP_202_ACCEPTED,
+                content=api_response.model_dump_json(),
+                headers=get_retry_after_header(get_quota_retry_after(e)),
+            )
     except gcp_exceptions.Forbidden:
         db_session.rollback()
         api_response = ApiResponse(status=Status.error, message="You don't have permission to access this GCP resource.")
@@ -164,7 +333,7 @@ async def stop_instance(
             )
         ]
 
-        # Stop all running instances without a valid heartbeat.
+        # Stop all running instances without a valid heartbeat. Stops over quota are left for the next sweep.
         futures = [
             run_in_threadpool(
                 stop_gce_instance,
@@ -174,10 +343,38 @@ async def stop_instance(
             )
             for instance in instances
         ]
-        await asyncio.gather(*futures)
+        results = await asyncio.gather(*futures, return_exceptions=True)
 
-        api_response = ApiResponse(status=Status.ok, message=f"{len(instances)} instances stopped.")
-        response = Response(status_code=status.HTTP_200_OK, content=api_response.model_dump_json())
+        deferred = [x for x in results if isinstance(x, QUOTA_ERRORS)]
+        for result in results:
+            if isinstance(result, Exception) and not isinstance(result, QUOTA_ERRORS):
+                raise result
+
+        if deferred:
+            api_response = ApiResponse(
+                status=Status.warning,
+                message=f"{len(instances) - len(deferred)} instances stopped, {len(deferred)} deferred due to GCE quota.",
+            )
+            response = Response(
+                status_code=status.HTTP_202_ACCEPTED,
+                content=api_response.model_dump_json(),
+                # Every deferred stop needs its own token, so wait until the bucket can cover all of them.
+                headers=get_retry_after_header(max(
+                    len(deferred) / get_gce_quota_limiter().rate,
+                    *(get_quota_retry_after(x) for x in deferred),
+                )),
+            )
+        else:
+            api_response = ApiResponse(status=Status.ok, message=f"{len(instances)} instances stopped.")
+            response = Response(status_code=status.HTTP_200_OK, content=api_response.model_dump_json())
+    except QUOTA_ERRORS as e:
+        db_session.rollback()
+        api_response = ApiResponse(status=Status.error, message="GCE quota exhausted, try again later.")
+        response = Response(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            content=api_response.model_dump_json(),
+            headers=get_retry_after_header(get_quota_retry_after(e)),
+        )
     except Exception:
         db_session.rollback()
         api_response = ApiResponse(status=Status.error, message="Unspecified error.")
@@ -208,6 +405,83 @@ async def clean_heartbeats(
 
     return response
 
+
+class GceQuotaBucket(BaseModel):
+    project: str
+    operation: str
+    tokens: float
+
+
+class GceQuotaResponse(BaseModel):
+    rate: float
+    capacity: float
+    buckets: list[GceQuotaBucket]
+
+
+@app.get('/metrics/gce-quota')
+async def gce_quota(
+    _: str = Depends(get_user_credentials),
+) -> Response:
+    limiter = get_gce_quota_limiter()
+    quota_response = GceQuotaResponse(
+        rate=limiter.rate,
+        capacity=limiter.capacity,
+        buckets=[
+            GceQuotaBucket(project=project, operation=operation.value, tokens=tokens)
+            for project, operation, tokens in limiter.levels()
+        ],
+    )
+    return Response(status_code=status.HTTP_200_OK, content=quota_response.model_dump_json())
+
+
+class ProfileSpanSummary(BaseModel):
+    name: str
+    duration_seconds: float
+
+
+class ProfileSummary(BaseModel):
+    id: str
+    method: str
+    path: str
+    started: dt.datetime
+    duration_seconds: float
+    sample_count: int
+    spans: list[ProfileSpanSummary]
+
+
+@app.get('/profiles')
+async def list_profiles(
+    _: str = Depends(get_user_credentials),
+) -> list[ProfileSummary]:
+    return [
+        ProfileSummary(
+            id=profile.id,
+            method=profile.method,
+            path=profile.path,
+            started=dt.datetime.utcfromtimestamp(profile.started),
+            duration_seconds=profile.duration_seconds,
+            sample_count=sum(profile.samples.values()),
+            spans=[ProfileSpanSummary(name=x.name, duration_seconds=x.duration_seconds) for x in profile.spans],
+        )
+        for profile in get_profiler().profiles()
+    ]
+
+
+@app.get('/profiles/{profile_id}')
+async def get_profile(
+    profile_id: str,
+    _: str = Depends(get_user_credentials),
+) -> Response:
+    profile = get_profiler().get(profile_id)
+    if profile is None:
+        api_response = ApiResponse(status=Status.error, message="Profile not found.")
+        return Response(status_code=status.HTTP_404_NOT_FOUND, content=api_response.model_dump_json())
+
+    return PlainTextResponse(status_code=status.HTTP_200_OK, content=profile.to_folded())
+
+
+app.add_middleware(ProfilingMiddleware, is_authorized=is_authorized)
+
 if __name__ == '__main__':
     import uvicorn
 
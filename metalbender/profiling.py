@@ -0,0 +1,225 @@
+import contextvars
+import functools
+import random
+import sys
+import threading
+import time
+import typing as t
+import uuid
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from starlette.concurrency import run_in_threadpool
+
+import metalbender.config as config
+
+_F = t.TypeVar("_F", bound=t.Callable[..., t.Any])
+
+_ACTIVE_PROFILE: contextvars.ContextVar["RequestProfile | None"] = contextvars.ContextVar("_ACTIVE_PROFILE", default=None)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+@dataclass
+class ProfileSpan:
+    name: str
+    duration_seconds: float
+
+
+@dataclass
+class RequestProfile:
+    """
+    Stack samples and timed spans collected for a single request.
+
+    Only threads registered while the request is running are sampled: the event loop thread handling the request,
+    and the thread-pool workers while they run a `profiled` function on its behalf. The event loop thread is shared,
+    so a profile also picks up the event loop stacks of requests running at the same time.
+    """
+
+    method: str
+    path: str
+    interval_seconds: float
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    started: float = field(default_factory=time.time)
+    duration_seconds: float = 0.0
+    samples: Counter = field(default_factory=Counter)
+    spans: list[ProfileSpan] = field(default_factory=list)
+
+    _threads: Counter = field(default_factory=Counter, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    _stopped: threading.Event = field(default_factory=threading.Event, repr=False)
+    _sampler: threading.Thread | None = field(default=None, repr=False)
+
+    def register_thread(self) -> None:
+        with self._lock:
+            self._threads[threading.get_ident()] += 1
+
+    def unregister_thread(self) -> None:
+        with self._lock:
+            thread_id = threading.get_ident()
+            self._threads[thread_id] -= 1
+            if self._threads[thread_id] <= 0:
+                del self._threads[thread_id]
+
+    def add_span(self, name: str, duration_seconds: float) -> None:
+        with self._lock:
+            self.spans.append(ProfileSpan(name=name, duration_seconds=duration_seconds))
+
+    def _sample(self) -> None:
+        with self._lock:
+            thread_ids = list(self._threads)
+
+        frames = sys._current_frames()
+        for thread_id in thread_ids:
+            frame = frames.get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def _run_sampler(self) -> None:
+        while not self._stopped.wait(self.interval_seconds):
+            self._sample()
+
+    def start(self) -> None:
+        self._sampler = threading.Thread(target=self._run_sampler, name=f"profiler-{self.id}", daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> None:
+        """
+        Stop the sampler and wait for its last sample. Blocks, so don't call it on the event loop.
+        """
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.duration_seconds = time.time() - self.started
+
+    def to_folded(self) -> str:
+        """
+        Render the samples in the folded stack format read by flamegraph.pl, speedscope and similar tools.
+        """
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+
+class Profiler:
+    """
+    Decides which requests to profile, and keeps the most recent profiles in memory.
+    """
+
+    def __init__(self, enabled: bool, sample_rate: float, interval_seconds: float, max_stored: int):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.interval_seconds = interval_seconds
+        self.max_stored = max_stored
+        self._profiles: OrderedDict[str, RequestProfile] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def should_profile(self, requested: bool) -> bool:
+        return self.enabled and (requested or random.random() < self.sample_rate)
+
+    def store(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles[profile.id] = profile
+            while len(self._profiles) > self.max_stored:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> RequestProfile | None:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def profiles(self) -> list[RequestProfile]:
+        with self._lock:
+            return list(self._profiles.values())
+
+
+@lru_cache(maxsize=1)
+def get_profiler() -> Profiler:
+    return Profiler(
+        enabled=config.get_profiling_enabled(),
+        sample_rate=config.get_profiling_sample_rate(),
+        interval_seconds=config.get_profiling_interval_seconds(),
+        max_stored=config.get_profiling_max_stored(),
+    )
+
+
+def profiled(func: _F) -> _F:
+    """
+    Time `func` as a span of the active request profile, and sample the thread it runs on.
+
+    Costs a single context variable lookup when the request isn't being profiled.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = _ACTIVE_PROFILE.get()
+        if profile is None:
+            return func(*args, **kwargs)
+
+        profile.register_thread()
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.add_span(f"{func.__module__}:{func.__qualname__}", time.perf_counter() - start)
+            profile.unregister_thread()
+
+    return t.cast(_F, wrapper)
+
+
+PROFILE_REQUEST_HEADER = b"x-metalbender-profile"
+PROFILE_ID_HEADER = b"x-metalbender-profile-id"
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling a sampled fraction of requests, and requests sent with the profile header.
+
+    The profile header is only honoured when `is_authorized` accepts the request's Authorization header. The id of
+    the stored profile is returned in the profile id response header.
+    """
+
+    def __init__(self, app, is_authorized: t.Callable[[str | None], bool]):
+        self.app = app
+        self.is_authorized = is_authorized
+
+    async def __call__(self, scope, receive, send):
+        profiler = get_profiler()
+        if scope["type"] != "http" or not profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        requested = headers.get(PROFILE_REQUEST_HEADER, b"").lower() in (b"1", b"true")
+        if requested:
+            authorization = headers.get(b"authorization")
+            requested = self.is_authorized(authorization.decode("latin-1") if authorization is not None else None)
+
+        if not profiler.should_profile(requested):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(method=scope["method"], path=scope["path"], interval_seconds=profiler.interval_seconds)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (PROFILE_ID_HEADER, profile.id.encode("latin-1"))]
+            await send(message)
+
+        token = _ACTIVE_PROFILE.set(profile)
+        profile.register_thread()
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile.unregister_thread()
+            # Joining the sampler blocks, so it happens off the event loop.
+            await run_in_threadpool(profile.stop)
+            _ACTIVE_PROFILE.reset(token)
+            profiler.store(profile)
@@ -0,0 +1,99 @@
+import threading
+import time
+from enum import Enum
+from functools import lru_cache
+
+import metalbender.config as config
+
+
+class GceOperation(str, Enum):
+    get = "get"
+    start = "start"
+    stop = "stop"
+    list = "list"
+
+
+class GceQuotaExceeded(Exception):
+    def __init__(self, project: str, operation: GceOperation, retry_after: float):
+        super().__init__(f"GCE {operation.value} quota exhausted for project {project}, retry in {retry_after:.1f}s.")
+        self.project = project
+        self.operation = operation
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `rate` tokens per second, up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        if rate <= 0 or capacity < 1:
+            raise ValueError(f"Invalid token bucket, rate={rate} capacity={capacity}")
+
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        Take `tokens` from the bucket if available.
+
+        :return: 0 if the tokens were taken, otherwise the seconds until they will be available.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    @property
+    def level(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+class GceQuotaLimiter:
+    """
+    Token buckets per (project, operation), created on first use.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets: dict[tuple[str, GceOperation], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _get_bucket(self, project: str, operation: GceOperation) -> TokenBucket:
+        key = (project, operation)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(rate=self.rate, capacity=self.capacity)
+                self._buckets[key] = bucket
+            return bucket
+
+    def acquire(self, project: str, operation: GceOperation) -> None:
+        retry_after = self._get_bucket(project, operation).try_acquire()
+        if retry_after > 0:
+            raise GceQuotaExceeded(project=project, operation=operation, retry_after=retry_after)
+
+    def levels(self) -> list[tuple[str, GceOperation, float]]:
+        with self._lock:
+            buckets = list(self._buckets.items())
+        return [(project, operation, bucket.level) for (project, operation), bucket in buckets]
+
+
+@lru_cache(maxsize=1)
+def get_gce_quota_limiter() -> GceQuotaLimiter:
+    return GceQuotaLimiter(
+        rate=config.get_gce_quota_rate(),
+        capacity=config.get_gce_quota_burst(),
+    )
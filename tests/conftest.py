@@ -0,0 +1,89 @@
+import os
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# The app reads its settings on import, so the test settings must be in place before metalbender is imported.
+_TEST_DIR = Path(tempfile.mkdtemp(prefix="metalbender-tests-"))
+os.environ["STORAGE_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = str(_TEST_DIR / "metalbender.db")
+os.environ["SQLITE_BUSY_TIMEOUT_SECONDS"] = "1"
+os.environ["FASTAPI_USERNAME"] = "admin"
+os.environ["FASTAPI_PASSWORD"] = "admin"
+os.environ["GCP_PROJECT_ID"] = "test-project"
+os.environ["PROFILING_ENABLED"] = "false"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import metalbender.main as main  # noqa: E402
+from metalbender.data_access import ENGINE, Base  # noqa: E402
+from metalbender.label_index import get_label_index  # noqa: E402
+from metalbender.profiling import get_profiler  # noqa: E402
+from metalbender.quota import get_gce_quota_limiter  # noqa: E402
+
+AUTH = ("admin", "admin")
+
+
+class FakeInstancesClient:
+    """
+    Stand-in for compute.InstancesClient, keeping instances in a dict and recording every call.
+    """
+
+    instances: dict[tuple[str, str], SimpleNamespace] = {}
+    calls: list[tuple[str, str | None]] = []
+
+    @classmethod
+    def add_instance(cls, name: str, status: str = "RUNNING", zone: str = "europe-west4-a", labels: dict | None = None):
+        cls.instances[(zone, name)] = SimpleNamespace(
+            name=name,
+            zone=f"https://www.googleapis.com/compute/v1/projects/test-project/zones/{zone}",
+            status=status,
+            labels=labels or {},
+        )
+
+    def get(self, project: str, zone: str, instance: str):
+        self.calls.append(("get", instance))
+        return self.instances[(zone, instance)]
+
+    def start(self, project: str, zone: str, instance: str):
+        self.calls.append(("start", instance))
+        self.instances[(zone, instance)].status = "RUNNING"
+
+    def stop(self, project: str, zone: str, instance: str):
+        self.calls.append(("stop", instance))
+        self.instances[(zone, instance)].status = "TERMINATED"
+
+    def aggregated_list(self, project: str):
+        self.calls.append(("list", None))
+        return [("zones/all", SimpleNamespace(instances=list(self.instances.values()), warning=SimpleNamespace(code="")))]
+
+
+@pytest.fixture(autouse=True)
+def _reset_state(monkeypatch):
+    for table in reversed(Base.metadata.sorted_tables):
+        with ENGINE.begin() as connection:
+            connection.execute(table.delete())
+
+    for cached in (get_gce_quota_limiter, get_profiler, get_label_index):
+        cached.cache_clear()
+
+    FakeInstancesClient.instances = {}
+    FakeInstancesClient.calls = []
+    monkeypatch.setattr("google.cloud.compute.InstancesClient", FakeInstancesClient)
+
+    yield
+
+    for cached in (get_gce_quota_limiter, get_profiler, get_label_index):
+        cached.cache_clear()
+
+
+@pytest.fixture
+def fake_compute() -> type[FakeInstancesClient]:
+    return FakeInstancesClient
+
+
+@pytest.fixture
+def client() -> TestClient:
+    return TestClient(main.app)
@@ -0,0 +1,177 @@
+import datetime as dt
+import threading
+import time
+
+import pytest
+from sqlalchemy import text
+
+import metalbender.data_access as data_access
+from metalbender.data_access import ENGINE, create_storage_engine
+from metalbender.data_access.gce import (create_gce_instance,
+                                         find_or_create_gce_instances)
+from metalbender.data_access.heartbeat import create_heartbeats
+from metalbender.data_access.models import GceInstance, Heartbeat
+from tests.conftest import AUTH
+
+
+def test_sqlite_backend_is_selected(tmp_path, monkeypatch):
+    monkeypatch.setenv("SQLITE_PATH", str(tmp_path / "selected.db"))
+    engine = create_storage_engine("sqlite")
+
+    assert engine.dialect.name == "sqlite"
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        tables = connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars().all()
+    assert {GceInstance.__tablename__, Heartbeat.__tablename__} <= set(tables)
+
+
+def test_sqlite_backend_sets_busy_timeout(tmp_path, monkeypatch):
+    monkeypatch.setenv("SQLITE_PATH", str(tmp_path / "timeout.db"))
+    monkeypatch.setenv("SQLITE_BUSY_TIMEOUT_SECONDS", "2.5")
+    engine = create_storage_engine("sqlite")
+
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA busy_timeout")).scalar() == 2500
+
+
+def test_postgres_backend_is_selected(monkeypatch):
+    sentinel = object()
+    monkeypatch.setitem(data_access._ENGINE_FACTORIES, "postgres", lambda: sentinel)
+
+    assert create_storage_engine("postgres") is sentinel
+
+
+def test_unknown_backend_raises():
+    with pytest.raises(ValueError, match="Unknown storage backend"):
+        create_storage_engine("mysql")
+
+
+def test_sqlite_backend_rejects_in_memory_database(monkeypatch):
+    monkeypatch.setenv("SQLITE_PATH", ":memory:")
+
+    with pytest.raises(ValueError, match="SQLITE_PATH"):
+        create_storage_engine("sqlite")
+
+
+def test_rollback_does_not_discard_concurrent_session():
+    session_a = data_access._SessionMaker()
+    session_b = data_access._SessionMaker()
+    try:
+        create_gce_instance(session_a, "test-project", "europe-west4-a", "kept")
+
+        def flush_and_rollback():
+            # Blocks on the SQLite write lock until session A has committed.
+            create_gce_instance(session_b, "test-project", "europe-west4-a", "discarded")
+            session_b.rollback()
+
+        thread = threading.Thread(target=flush_and_rollback)
+        thread.start()
+        session_a.commit()
+        thread.join(timeout=10)
+        assert not thread.is_alive()
+    finally:
+        session_a.close()
+        session_b.close()
+
+    with ENGINE.connect() as connection:
+        names = connection.execute(text("SELECT name FROM gce_instance")).scalars().all()
+    assert names == ["kept"]
+
+
+def test_concurrent_keep_alives_do_not_wait_on_compute(client, fake_compute, monkeypatch):
+    fake_compute.add_instance("vm1")
+    fake_compute.add_instance("vm2")
+    get = fake_compute.get
+
+    def slow_get(self, **kwargs):
+        # Longer than the test busy timeout, so a write held open across this call fails the other request.
+        time.sleep(1.5)
+        return get(self, **kwargs)
+
+    monkeypatch.setattr(fake_compute, "get", slow_get)
+
+    status_codes = {}
+
+    def keep_alive(instance_name: str):
+        response = client.post(
+            "/keep-alive",
+            auth=AUTH,
+            json={
+                "instance_project_id": "test-project",
+                "instance_zone": "europe-west4-a",
+                "instance_name": instance_name,
+                "deadline_seconds": 60,
+            },
+        )
+        status_codes[instance_name] = response.status_code
+
+    threads = [threading.Thread(target=keep_alive, args=(x,)) for x in ("vm1", "vm2")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert status_codes == {"vm1": 200, "vm2": 200}
+    with ENGINE.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM heartbeat")).scalar() == 2
+
+
+def test_keep_alive_then_stop_round_trip(client, fake_compute):
+    fake_compute.add_instance("kept", status="TERMINATED")
+    fake_compute.add_instance("idle", status="RUNNING")
+
+    response = client.post(
+        "/keep-alive",
+        auth=AUTH,
+        json={
+            "instance_project_id": "test-project",
+            "instance_zone": "europe-west4-a",
+            "instance_name": "kept",
+            "deadline_seconds": 60,
+        },
+    )
+    assert response.status_code == 200
+    assert ("start", "kept") in fake_compute.calls
+
+    response = client.post("/stop", auth=AUTH)
+    assert response.status_code == 200
+    assert response.json()["message"] == "1 instances stopped."
+    assert ("stop", "idle") in fake_compute.calls
+    assert ("stop", "kept") not in fake_compute.calls
+
+    with ENGINE.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM heartbeat")).scalar() == 1
+
+
+def test_find_or_create_gce_instances_reuses_existing_rows():
+    session = data_access._SessionMaker()
+    try:
+        existing = create_gce_instance(session, "test-project", "europe-west4-a", "vm1")
+        # Same name in another zone is a different instance.
+        keys = [("europe-west4-a", "vm1"), ("europe-west4-b", "vm1"), ("europe-west4-a", "vm2")]
+
+        instances = find_or_create_gce_instances(session, "test-project", keys)
+        assert [(x.zone, x.name) for x in instances] == keys
+        assert instances[0].id == existing.id
+
+        again = find_or_create_gce_instances(session, "test-project", keys)
+        assert [x.id for x in again] == [x.id for x in instances]
+        assert session.query(GceInstance).count() == 3
+    finally:
+        session.close()
+
+
+def test_create_heartbeats_shares_deadline():
+    session = data_access._SessionMaker()
+    try:
+        instances = find_or_create_gce_instances(
+            session, "test-project", [("europe-west4-a", "vm1"), ("europe-west4-a", "vm2")])
+        deadline = dt.datetime(2030, 1, 1)
+
+        heartbeats = create_heartbeats(session, [x.id for x in instances], deadline)
+
+        assert [x.instance_id for x in heartbeats] == [x.id for x in instances]
+        assert all(x.id is not None and x.deadline == deadline for x in heartbeats)
+        assert heartbeats[0].added == heartbeats[1].added
+    finally:
+        session.close()
@@ -0,0 +1,206 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import text
+
+import metalbender.label_index as label_index_module
+from metalbender.data_access import ENGINE
+from metalbender.label_index import IndexedInstance, LabelIndex
+from tests.conftest import AUTH
+
+
+def _instance(name: str, status: str = "RUNNING", **labels: str) -> IndexedInstance:
+    return IndexedInstance(
+        project_id="test-project",
+        zone="europe-west4-a",
+        name=name,
+        status=status,
+        labels=tuple(sorted(labels.items())),
+    )
+
+
+def _names(instances: list[IndexedInstance]) -> list[str]:
+    return [x.name for x in instances]
+
+
+def _keep_alive_labels(client, **labels: str):
+    return client.post(
+        "/keep-alive/labels",
+        auth=AUTH,
+        json={"instance_project_id": "test-project", "labels": labels, "deadline_seconds": 60},
+    )
+
+
+def test_match_requires_every_label():
+    index = LabelIndex(max_age_seconds=300)
+    index.update("test-project", [
+        _instance("vm1", team="ml", pool="gpu"),
+        _instance("vm2", team="ml", pool="cpu"),
+        _instance("vm3", team="web", pool="gpu"),
+    ])
+
+    assert _names(index.match("test-project", {"team": "ml", "pool": "gpu"})) == ["vm1"]
+    assert _names(index.match("test-project", {"team": "ml"})) == ["vm1", "vm2"]
+    assert index.match("test-project", {"team": "missing"}) == []
+    assert index.match("test-project", {}) == []
+    assert index.match("other-project", {"team": "ml"}) == []
+
+
+def test_update_moves_changed_instances_and_removes_missing_ones():
+    index = LabelIndex(max_age_seconds=300)
+    index.update("test-project", [
+        _instance("vm1", team="ml"),
+        _instance("vm2", team="ml"),
+        _instance("vm3", team="web"),
+    ])
+
+    index.update("test-project", [
+        _instance("vm1", team="ml"),
+        _instance("vm2", team="web"),
+        _instance("vm4", team="ml"),
+    ])
+
+    assert _names(index.match("test-project", {"team": "ml"})) == ["vm1", "vm4"]
+    assert _names(index.match("test-project", {"team": "web"})) == ["vm2"]
+    # Postings emptied by a removal or a move are dropped.
+    assert set(index._postings["test-project"]) == {("team", "ml"), ("team", "web")}
+    assert set(index._instances["test-project"]) == {("europe-west4-a", x) for x in ("vm1", "vm2", "vm4")}
+
+    index.update("test-project", [])
+    assert index._postings["test-project"] == {}
+    assert index._instances["test-project"] == {}
+
+
+def test_update_only_replaces_the_listed_project():
+    index = LabelIndex(max_age_seconds=300)
+    index.update("test-project", [_instance("vm1", team="ml")])
+    index.update("other-project", [])
+
+    assert _names(index.match("test-project", {"team": "ml"})) == ["vm1"]
+
+
+def test_lookups_do_not_add_projects():
+    index = LabelIndex(max_age_seconds=300)
+
+    assert index.match("unknown-project", {"team": "ml"}) == []
+    index.set_status("unknown-project", "europe-west4-a", "vm1", "STOPPING")
+
+    assert "unknown-project" not in index._instances
+    assert "unknown-project" not in index._postings
+
+
+def test_set_status_keeps_labels():
+    index = LabelIndex(max_age_seconds=300)
+    index.update("test-project", [_instance("vm1", team="ml")])
+
+    index.set_status("test-project", "europe-west4-a", "vm1", "STOPPING")
+    index.set_status("test-project", "europe-west4-a", "missing", "STOPPING")
+
+    [instance] = index.match("test-project", {"team": "ml"})
+    assert instance.status == "STOPPING"
+    assert not instance.is_active
+    assert index.match("test-project", {"team": "ml", "name": "missing"}) == []
+
+
+def test_index_goes_stale(monkeypatch):
+    clock = SimpleNamespace(now=100.0)
+    monkeypatch.setattr(label_index_module, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    index = LabelIndex(max_age_seconds=300)
+
+    assert index.is_stale("test-project")
+    index.update("test-project", [])
+    assert not index.is_stale("test-project")
+
+    clock.now += 301
+    assert index.is_stale("test-project")
+
+
+def test_keep_alive_labels_extends_all_matches(client, fake_compute):
+    fake_compute.add_instance("vm1", status="TERMINATED", labels={"team": "ml", "pool": "gpu"})
+    fake_compute.add_instance("vm2", status="RUNNING", labels={"team": "ml", "pool": "gpu"})
+    fake_compute.add_instance("vm3", status="TERMINATED", labels={"team": "ml", "pool": "cpu"})
+
+    response = _keep_alive_labels(client, team="ml", pool="gpu")
+    assert response.status_code == 200
+    assert response.json()["message"] == "Keep-alive request added for 2 instances."
+    assert fake_compute.calls == [("list", None), ("start", "vm1")]
+
+    # Every request makes a single listing, and only starts what isn't running.
+    assert _keep_alive_labels(client, team="ml", pool="gpu").status_code == 200
+    assert fake_compute.calls == [("list", None), ("start", "vm1"), ("list", None)]
+
+    with ENGINE.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM gce_instance")).scalar() == 2
+        assert connection.execute(text("SELECT count(*) FROM heartbeat")).scalar() == 4
+
+
+def test_keep_alive_labels_restarts_instance_stopped_by_sweep(client, fake_compute):
+    fake_compute.add_instance("vm1", status="RUNNING", labels={"team": "ml"})
+
+    response = client.post("/stop", auth=AUTH)
+    assert response.json()["message"] == "1 instances stopped."
+    assert fake_compute.instances[("europe-west4-a", "vm1")].status == "TERMINATED"
+
+    response = _keep_alive_labels(client, team="ml")
+    assert response.status_code == 200
+    assert ("start", "vm1") in fake_compute.calls
+    assert fake_compute.instances[("europe-west4-a", "vm1")].status == "RUNNING"
+
+
+def test_keep_alive_labels_restarts_instance_stopped_elsewhere(client, fake_compute):
+    fake_compute.add_instance("vm1", status="RUNNING", labels={"team": "ml"})
+    assert _keep_alive_labels(client, team="ml").status_code == 200
+
+    # Stopped by another replica, preemption or by hand, while the index is still fresh.
+    fake_compute.instances[("europe-west4-a", "vm1")].status = "TERMINATED"
+
+    assert _keep_alive_labels(client, team="ml").status_code == 200
+    assert ("start", "vm1") in fake_compute.calls
+
+
+def test_keep_alive_labels_finds_new_instances(client, fake_compute):
+    fake_compute.add_instance("vm1", labels={"team": "ml"})
+    assert _keep_alive_labels(client, team="ml").status_code == 200
+
+    fake_compute.add_instance("vm2", labels={"team": "new"})
+    assert _keep_alive_labels(client, team="new").status_code == 200
+    assert _keep_alive_labels(client, team="missing").status_code == 400
+
+
+def test_keep_alive_labels_over_list_quota_uses_fresh_index(client, fake_compute, monkeypatch):
+    monkeypatch.setenv("GCE_QUOTA_RATE", "0.5")
+    monkeypatch.setenv("GCE_QUOTA_BURST", "1")
+    fake_compute.add_instance("vm1", status="TERMINATED", labels={"team": "ml"})
+    assert client.post("/stop", auth=AUTH).status_code == 200
+
+    response = _keep_alive_labels(client, team="ml")
+    assert response.status_code == 202
+    assert response.headers["Retry-After"] == "2"
+    assert fake_compute.calls == [("list", None)]
+
+    with ENGINE.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM heartbeat")).scalar() == 1
+
+
+def test_keep_alive_labels_over_list_quota_with_stale_index_returns_429(client, fake_compute, monkeypatch):
+    monkeypatch.setenv("GCE_QUOTA_RATE", "0.5")
+    monkeypatch.setenv("GCE_QUOTA_BURST", "1")
+    monkeypatch.setenv("LABEL_INDEX_MAX_AGE_SECONDS", "0")
+    fake_compute.add_instance("vm1", labels={"team": "ml"})
+    assert client.post("/stop", auth=AUTH).status_code == 200
+
+    response = _keep_alive_labels(client, team="ml")
+    assert response.status_code == 429
+
+    with ENGINE.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM heartbeat")).scalar() == 0
+
+
+@pytest.mark.parametrize("labels", [{}, {"team": "ml"}])
+def test_keep_alive_labels_rejects_unresolvable_selectors(client, labels):
+    response = client.post(
+        "/keep-alive/labels",
+        auth=AUTH,
+        json={"instance_project_id": "test-project", "labels": labels, "deadline_seconds": 60},
+    )
+    assert response.status_code == 400
@@ -0,0 +1,112 @@
+import asyncio
+import re
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import metalbender.profiling as profiling
+from metalbender.profiling import Profiler, RequestProfile, get_profiler, profiled
+from tests.conftest import AUTH
+
+PROFILE_HEADERS = {"X-Metalbender-Profile": "1"}
+
+
+@pytest.fixture
+def profiling_enabled(monkeypatch):
+    monkeypatch.setenv("PROFILING_ENABLED", "true")
+    monkeypatch.setenv("PROFILING_SAMPLE_RATE", "0")
+    monkeypatch.setenv("PROFILING_INTERVAL_SECONDS", "0.001")
+
+
+def test_unauthenticated_profile_header_is_ignored(client, profiling_enabled):
+    response = client.get("/health", auth=("admin", "wrong"), headers=PROFILE_HEADERS)
+
+    assert response.status_code == 401
+    assert "X-Metalbender-Profile-Id" not in response.headers
+    assert get_profiler().profiles() == []
+
+
+def test_authenticated_profile_header_is_profiled(client, fake_compute, profiling_enabled, monkeypatch):
+    fake_compute.add_instance("vm1")
+    slow_get = fake_compute.get
+
+    def get(self, **kwargs):
+        time.sleep(0.05)
+        return slow_get(self, **kwargs)
+
+    monkeypatch.setattr(fake_compute, "get", get)
+
+    response = client.post(
+        "/keep-alive",
+        auth=AUTH,
+        headers=PROFILE_HEADERS,
+        json={
+            "instance_project_id": "test-project",
+            "instance_zone": "europe-west4-a",
+            "instance_name": "vm1",
+            "deadline_seconds": 60,
+        },
+    )
+    assert response.status_code == 200
+    profile_id = response.headers["X-Metalbender-Profile-Id"]
+
+    summaries = client.get("/profiles", auth=AUTH).json()
+    assert [x["id"] for x in summaries] == [profile_id]
+    assert summaries[0]["path"] == "/keep-alive"
+    span_names = [x["name"] for x in summaries[0]["spans"]]
+    assert "metalbender.gce_tools:start_gce_instance" in span_names
+    assert "metalbender.data_access.heartbeat:create_heartbeat" in span_names
+
+    folded = client.get(f"/profiles/{profile_id}", auth=AUTH).text
+    assert folded == get_profiler().get(profile_id).to_folded()
+    lines = folded.splitlines()
+    assert lines
+    assert all(re.fullmatch(r"[^ ;]+(;[^ ;]+)* \d+", x) for x in lines)
+    assert any("metalbender.gce_tools:start_gce_instance" in x for x in lines)
+
+
+def test_profile_is_stopped_off_the_event_loop(client, profiling_enabled, monkeypatch):
+    stop = RequestProfile.stop
+    on_event_loop = []
+
+    def checked_stop(self):
+        try:
+            asyncio.get_running_loop()
+            on_event_loop.append(True)
+        except RuntimeError:
+            on_event_loop.append(False)
+        stop(self)
+
+    monkeypatch.setattr(RequestProfile, "stop", checked_stop)
+
+    response = client.get("/health", auth=AUTH, headers=PROFILE_HEADERS)
+    assert "X-Metalbender-Profile-Id" in response.headers
+    assert on_event_loop == [False]
+
+
+def test_missing_profile_returns_404(client):
+    assert client.get("/profiles/missing", auth=AUTH).status_code == 404
+
+
+def test_disabled_profiling_stays_on_fast_path(client, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("Profiling should be disabled")
+
+    monkeypatch.setattr(profiling, "time", SimpleNamespace(perf_counter=fail, time=fail))
+    monkeypatch.setattr(profiling, "RequestProfile", fail)
+
+    response = client.get("/health", auth=AUTH, headers=PROFILE_HEADERS)
+    assert response.status_code == 200
+    assert "X-Metalbender-Profile-Id" not in response.headers
+    assert profiled(lambda x: x + 1)(1) == 2
+
+
+def test_profiles_beyond_max_stored_are_evicted():
+    profiler = Profiler(enabled=True, sample_rate=0, interval_seconds=0.01, max_stored=2)
+    profiles = [RequestProfile(method="GET", path=f"/{x}", interval_seconds=0.01) for x in range(3)]
+    for profile in profiles:
+        profiler.store(profile)
+
+    assert profiler.profiles() == profiles[1:]
+    assert profiler.get(profiles[0].id) is None
@@ -0,0 +1,191 @@
+from types import SimpleNamespace
+
+import pytest
+from google.api_core import exceptions as gcp_exceptions
+from sqlalchemy import text
+
+import metalbender.quota as quota
+from metalbender.data_access import ENGINE
+from metalbender.quota import (GceOperation, GceQuotaExceeded,
+                               GceQuotaLimiter, TokenBucket,
+                               get_gce_quota_limiter)
+from tests.conftest import AUTH
+
+
+@pytest.fixture
+def clock(monkeypatch) -> SimpleNamespace:
+    fake_clock = SimpleNamespace(now=100.0)
+    monkeypatch.setattr(quota, "time", SimpleNamespace(monotonic=lambda: fake_clock.now))
+    return fake_clock
+
+
+@pytest.fixture
+def small_quota(monkeypatch):
+    monkeypatch.setenv("GCE_QUOTA_RATE", "0.5")
+    monkeypatch.setenv("GCE_QUOTA_BURST", "1")
+
+
+def _keep_alive_body(instance_name: str) -> dict:
+    return {
+        "instance_project_id": "test-project",
+        "instance_zone": "europe-west4-a",
+        "instance_name": instance_name,
+        "deadline_seconds": 60,
+    }
+
+
+def test_token_bucket_refill_and_retry_after(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+    clock.now += 0.25
+    assert bucket.level == pytest.approx(0.5)
+    assert bucket.try_acquire() == pytest.approx(0.25)
+
+    clock.now += 0.25
+    assert bucket.try_acquire() == 0.0
+
+    # Refills never exceed the capacity.
+    clock.now += 60
+    assert bucket.level == pytest.approx(3)
+
+
+def test_token_bucket_rejects_invalid_settings():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0, capacity=1)
+    with pytest.raises(ValueError):
+        TokenBucket(rate=1, capacity=0.5)
+
+
+def test_limiter_buckets_are_per_project_and_operation(clock):
+    limiter = GceQuotaLimiter(rate=1, capacity=1)
+    limiter.acquire("a", GceOperation.get)
+    limiter.acquire("a", GceOperation.start)
+    limiter.acquire("b", GceOperation.get)
+
+    with pytest.raises(GceQuotaExceeded) as exc_info:
+        limiter.acquire("a", GceOperation.get)
+    assert exc_info.value.project == "a"
+    assert exc_info.value.operation is GceOperation.get
+    assert exc_info.value.retry_after == pytest.approx(1)
+
+    assert sorted((p, o.value, level) for p, o, level in limiter.levels()) == [
+        ("a", "get", 0.0),
+        ("a", "start", 0.0),
+        ("b", "get", 0.0),
+    ]
+
+
+def test_keep_alive_over_quota_keeps_heartbeat(client, fake_compute, small_quota):
+    fake_compute.add_instance("vm1")
+    fake_compute.add_instance("vm2")
+
+    assert client.post("/keep-alive", auth=AUTH, json=_keep_alive_body("vm1")).status_code == 200
+
+    response = client.post("/keep-alive", auth=AUTH, json=_keep_alive_body("vm2"))
+    assert response.status_code == 202
+    assert response.headers["Retry-After"] == "2"
+    assert response.json()["status"] == "warning"
+    assert "check deferred" in response.json()["message"]
+    assert ("get", "vm2") not in fake_compute.calls
+
+    with ENGINE.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM heartbeat")).scalar() == 2
+
+
+def test_keep_alive_over_start_quota_says_start_deferred(client, fake_compute, small_quota):
+    fake_compute.add_instance("vm1", status="TERMINATED")
+    get_gce_quota_limiter().acquire("test-project", GceOperation.start)
+
+    response = client.post("/keep-alive", auth=AUTH, json=_keep_alive_body("vm1"))
+    assert response.status_code == 202
+    assert response.json()["message"] == "Keep-alive request added, instance start deferred due to GCE quota, retry the keep-alive."
+    assert fake_compute.calls == [("get", "vm1")]
+
+
+def test_keep_alive_on_compute_429_keeps_heartbeat(client, fake_compute, small_quota, monkeypatch):
+    def get(self, **kwargs):
+        raise gcp_exceptions.TooManyRequests("Quota exceeded")
+
+    monkeypatch.setattr(fake_compute, "get", get)
+
+    response = client.post("/keep-alive", auth=AUTH, json=_keep_alive_body("vm1"))
+    assert response.status_code == 202
+    assert response.headers["Retry-After"] == "2"
+
+    with ENGINE.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM heartbeat")).scalar() == 1
+
+
+def test_stop_on_compute_429_when_listing_returns_429(client, fake_compute, small_quota, monkeypatch):
+    def aggregated_list(self, project):
+        raise gcp_exceptions.TooManyRequests("Quota exceeded")
+
+    monkeypatch.setattr(fake_compute, "aggregated_list", aggregated_list)
+
+    response = client.post("/stop", auth=AUTH)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+
+
+def test_stop_on_compute_429_defers_instances(client, fake_compute, monkeypatch):
+    for name in ("vm1", "vm2"):
+        fake_compute.add_instance(name)
+    stop = fake_compute.stop
+
+    def flaky_stop(self, **kwargs):
+        if kwargs["instance"] == "vm2":
+            raise gcp_exceptions.TooManyRequests("Quota exceeded")
+        return stop(self, **kwargs)
+
+    monkeypatch.setattr(fake_compute, "stop", flaky_stop)
+
+    response = client.post("/stop", auth=AUTH)
+    assert response.status_code == 202
+    assert response.json()["message"] == "1 instances stopped, 1 deferred due to GCE quota."
+
+
+def test_stop_over_list_quota_returns_429(client, fake_compute, small_quota):
+    assert client.post("/stop", auth=AUTH).status_code == 200
+
+    response = client.post("/stop", auth=AUTH)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    assert fake_compute.calls == [("list", None)]
+
+
+def test_stop_over_stop_quota_defers_instances(client, fake_compute, monkeypatch):
+    monkeypatch.setenv("GCE_QUOTA_RATE", "0.5")
+    monkeypatch.setenv("GCE_QUOTA_BURST", "2")
+    for name in ("vm1", "vm2", "vm3"):
+        fake_compute.add_instance(name)
+
+    response = client.post("/stop", auth=AUTH)
+    assert response.status_code == 202
+    assert response.headers["Retry-After"] == "2"
+    assert response.json()["message"] == "2 instances stopped, 1 deferred due to GCE quota."
+    assert len([x for x in fake_compute.calls if x[0] == "stop"]) == 2
+
+
+def test_stop_retry_after_covers_every_deferred_instance(client, fake_compute, small_quota):
+    for name in ("vm1", "vm2", "vm3"):
+        fake_compute.add_instance(name)
+
+    response = client.post("/stop", auth=AUTH)
+    assert response.status_code == 202
+    assert response.json()["message"] == "1 instances stopped, 2 deferred due to GCE quota."
+    # Two tokens at 0.5 tokens per second.
+    assert response.headers["Retry-After"] == "4"
+
+
+def test_gce_quota_metrics(client, fake_compute, small_quota):
+    client.post("/stop", auth=AUTH)
+
+    response = client.get("/metrics/gce-quota", auth=AUTH)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["rate"] == 0.5
+    assert body["capacity"] == 1
+    assert [(x["project"], x["operation"]) for x in body["buckets"]] == [("test-project", "list")]